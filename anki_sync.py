@@ -5,53 +5,92 @@ Syncs scraped verb pair data to Anki via AnkiConnect API.
 """
 
 import base64
-import json
-import urllib.request
+import functools
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import sys
 from pathlib import Path
 
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+
 # Configuration
 ANKI_CONNECT_URL = "http://localhost:8765"
 DECK_NAME = "Japanese::Verb Pairs"
 MODEL_NAME = "Japanese Verb Pair"
 
+# Shared session so every request reuses the same TCP connection
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 DATA_DIR = Path(__file__).parent / "data"
 IMAGES_DIR = Path(__file__).parent / "images"
+SYNC_STATE_DB = Path(__file__).parent / "sync_state.sqlite"
+MEDIA_MANIFEST = Path(__file__).parent / "media_manifest.json"
+
+logger = logging.getLogger(__name__)
+
+# Notes per `multi` request; keeps JSON bodies a reasonable size
+BATCH_SIZE = 200
 
 
 def anki_request(action: str, **params) -> dict:
     """Send a request to AnkiConnect."""
-    request_data = json.dumps({
+    request_data = orjson.dumps({
         "action": action,
         "version": 6,
         "params": params
-    }).encode("utf-8")
+    })
 
     try:
-        response = urllib.request.urlopen(
-            urllib.request.Request(ANKI_CONNECT_URL, request_data),
-            timeout=10
-        )
-        result = json.loads(response.read().decode("utf-8"))
+        response = _session.post(ANKI_CONNECT_URL, data=request_data, timeout=10)
+        result = response.json()
 
         if result.get("error"):
             raise Exception(f"AnkiConnect error: {result['error']}")
 
         return result.get("result")
-    except urllib.error.URLError as e:
+    except requests.RequestException as e:
         raise Exception(f"Cannot connect to Anki. Is Anki running with AnkiConnect? ({e})")
 
 
+def anki_multi(actions: list[dict]) -> list[tuple]:
+    """Run sub-actions in one `multi` request.
+
+    Sub-actions carry their own version key so AnkiConnect reports each
+    one's error instead of collapsing failures to a bare None result.
+    Returns one (result, error) tuple per action.
+    """
+    results = anki_request(
+        "multi",
+        actions=[{**action, "version": 6} for action in actions]
+    )
+    outcomes = []
+    for item in results:
+        if isinstance(item, dict):
+            outcomes.append((item.get("result"), item.get("error")))
+        else:
+            outcomes.append((item, None))
+    return outcomes
+
+
 def check_anki_connection():
     """Check if Anki is running and AnkiConnect is available."""
     try:
         version = anki_request("version")
-        print(f"Connected to AnkiConnect version {version}")
+        logger.info("Connected to AnkiConnect version %s", version)
         return True
     except Exception as e:
-        print(f"Error: {e}")
-        print("\nMake sure:")
-        print("1. Anki is running")
-        print("2. AnkiConnect add-on is installed (Code: 2055492159)")
+        logger.error("Error: %s", e)
+        logger.error("\nMake sure:")
+        logger.error("1. Anki is running")
+        logger.error("2. AnkiConnect add-on is installed (Code: 2055492159)")
         return False
 
 
@@ -60,33 +99,29 @@ def ensure_deck_exists():
     decks = anki_request("deckNames")
     if DECK_NAME not in decks:
         anki_request("createDeck", deck=DECK_NAME)
-        print(f"Created deck: {DECK_NAME}")
+        logger.info("Created deck: %s", DECK_NAME)
     else:
-        print(f"Deck exists: {DECK_NAME}")
-
-
-def ensure_model_exists():
-    """Create the note type (model) if it doesn't exist."""
-    models = anki_request("modelNames")
-
-    if MODEL_NAME not in models:
-        # Create model with fields for verb pairs
-        anki_request("createModel",
-            modelName=MODEL_NAME,
-            inOrderFields=[
-                "VerbPairID",
-                "IntransitiveKanji",
-                "IntransitiveReading",
-                "TransitiveKanji",
-                "TransitiveReading",
-                "Level",
-                "Image",
-                "PracticeQuestions",
-                "Answers",
-                "SourceURL",
-                "Attribution"
-            ],
-            css="""
+        logger.info("Deck exists: %s", DECK_NAME)
+
+
+# Note-type definition, kept at module scope so ensure_model_exists
+# doesn't rebuild the multi-kilobyte CSS/template payload on runs where
+# the model already exists
+_MODEL_FIELDS = [
+    "VerbPairID",
+    "IntransitiveKanji",
+    "IntransitiveReading",
+    "TransitiveKanji",
+    "TransitiveReading",
+    "Level",
+    "Image",
+    "PracticeQuestions",
+    "Answers",
+    "SourceURL",
+    "Attribution"
+]
+
+_MODEL_CSS = """
 .card {
     font-family: "Hiragino Kaku Gothic Pro", "Yu Gothic", "Meiryo", sans-serif;
     font-size: 24px;
@@ -163,11 +198,12 @@ def ensure_model_exists():
     color: #999;
     margin-top: 20px;
 }
-            """,
-            cardTemplates=[
-                {
-                    "Name": "Verb Pair Recognition",
-                    "Front": """
+"""
+
+_MODEL_CARD_TEMPLATES = [
+    {
+        "Name": "Verb Pair Recognition",
+        "Front": """
 <div class="level-tag level-{{Level}}">{{Level}}</div>
 
 <div class="image-container">
@@ -183,8 +219,8 @@ def ensure_model_exists():
 <div class="particle">
     が (intransitive) vs を (transitive)
 </div>
-                    """,
-                    "Back": """
+        """,
+        "Back": """
 {{FrontSide}}
 
 <hr>
@@ -213,11 +249,11 @@ def ensure_model_exists():
 <div class="attribution">
 {{Attribution}} | <a href="{{SourceURL}}">Source</a>
 </div>
-                    """
-                },
-                {
-                    "Name": "Intransitive → Transitive",
-                    "Front": """
+        """
+    },
+    {
+        "Name": "Intransitive → Transitive",
+        "Front": """
 <div class="level-tag level-{{Level}}">{{Level}}</div>
 
 <p>What is the <strong>transitive</strong> (他動詞) pair of:</p>
@@ -229,8 +265,8 @@ def ensure_model_exists():
 <div class="particle">
     (〜が {{IntransitiveKanji}})
 </div>
-                    """,
-                    "Back": """
+        """,
+        "Back": """
 {{FrontSide}}
 
 <hr>
@@ -246,11 +282,11 @@ def ensure_model_exists():
 <div class="image-container">
 {{Image}}
 </div>
-                    """
-                },
-                {
-                    "Name": "Transitive → Intransitive",
-                    "Front": """
+        """
+    },
+    {
+        "Name": "Transitive → Intransitive",
+        "Front": """
 <div class="level-tag level-{{Level}}">{{Level}}</div>
 
 <p>What is the <strong>intransitive</strong> (自動詞) pair of:</p>
@@ -262,8 +298,8 @@ def ensure_model_exists():
 <div class="particle">
     (〜を {{TransitiveKanji}})
 </div>
-                    """,
-                    "Back": """
+        """,
+        "Back": """
 {{FrontSide}}
 
 <hr>
@@ -279,24 +315,79 @@ def ensure_model_exists():
 <div class="image-container">
 {{Image}}
 </div>
-                    """
-                }
-            ]
-        )
-        print(f"Created model: {MODEL_NAME}")
-    else:
-        print(f"Model exists: {MODEL_NAME}")
+        """
+    }
+]
+
+
+def ensure_model_exists():
+    """Create the note type (model) if it doesn't exist."""
+    models = anki_request("modelNames")
+    if MODEL_NAME in models:
+        logger.info("Model exists: %s", MODEL_NAME)
+        return
+
+    anki_request("createModel",
+        modelName=MODEL_NAME,
+        inOrderFields=_MODEL_FIELDS,
+        css=_MODEL_CSS,
+        cardTemplates=_MODEL_CARD_TEMPLATES
+    )
+    logger.info("Created model: %s", MODEL_NAME)
+
+
+
+_media_manifest: dict | None = None
+
+
+def _load_media_manifest() -> dict:
+    """Load the filename -> content hash map of already-uploaded media."""
+    global _media_manifest
+    if _media_manifest is None:
+        if MEDIA_MANIFEST.exists():
+            _media_manifest = orjson.loads(MEDIA_MANIFEST.read_bytes())
+        else:
+            _media_manifest = {}
+    return _media_manifest
 
 
+def _save_media_manifest():
+    MEDIA_MANIFEST.write_bytes(
+        orjson.dumps(_media_manifest, option=orjson.OPT_INDENT_2)
+    )
+
+
+@functools.lru_cache(maxsize=256)
 def store_image(filename: str) -> str | None:
-    """Store an image in Anki's media folder and return the filename."""
+    """Store an image in Anki's media folder and return the filename.
+
+    Memoized so notes sharing an image only read, hash and upload it
+    once per run.
+    """
     filepath = IMAGES_DIR / filename
     if not filepath.exists():
         return None
 
-    # Read and base64 encode the image
+    # Skip the encode and upload when this exact file content was
+    # already pushed to Anki on a previous run
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(64 * 1024):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+
+    manifest = _load_media_manifest()
+    if manifest.get(filename) == file_hash:
+        return filename
+
+    # Base64-encode in chunks instead of materializing the whole file
+    # plus its encoded copy; 57KB is divisible by 3 so chunks concatenate
+    # without padding seams
+    chunks = []
     with open(filepath, "rb") as f:
-        data = base64.b64encode(f.read()).decode("utf-8")
+        while chunk := f.read(57 * 1024):
+            chunks.append(base64.b64encode(chunk))
+    data = b"".join(chunks).decode("ascii")
 
     # Store in Anki
     stored_name = anki_request("storeMediaFile",
@@ -304,6 +395,9 @@ def store_image(filename: str) -> str | None:
         data=data
     )
 
+    manifest[filename] = file_hash
+    _save_media_manifest()
+
     return stored_name or filename
 
 
@@ -322,15 +416,8 @@ def format_answers(answers: list[str]) -> str:
     return "<br>".join(answers[:5])
 
 
-def add_or_update_note(verb_data: dict) -> bool:
-    """Add a new note or update existing one."""
-    verb_id = verb_data["id"]
-
-    # Check if note already exists
-    existing = anki_request("findNotes",
-        query=f'"deck:{DECK_NAME}" "VerbPairID:{verb_id}"'
-    )
-
+def build_fields(verb_data: dict) -> dict:
+    """Build the note fields dict for a verb pair."""
     # Store image if available
     image_field = ""
     if verb_data.get("images"):
@@ -339,9 +426,8 @@ def add_or_update_note(verb_data: dict) -> bool:
         if stored_name:
             image_field = f'<img src="{stored_name}">'
 
-    # Prepare fields
-    fields = {
-        "VerbPairID": verb_id,
+    return {
+        "VerbPairID": verb_data["id"],
         "IntransitiveKanji": verb_data["intransitive"]["kanji"],
         "IntransitiveReading": verb_data["intransitive"]["reading"] or "",
         "TransitiveKanji": verb_data["transitive"]["kanji"],
@@ -354,32 +440,190 @@ def add_or_update_note(verb_data: dict) -> bool:
         "Attribution": verb_data["attribution"]
     }
 
-    if existing:
-        # Update existing note
-        note_id = existing[0]
-        anki_request("updateNoteFields",
-            note={
-                "id": note_id,
-                "fields": fields
-            }
-        )
-        print(f"  Updated: {verb_id}")
-        return False  # Not new
-    else:
-        # Add new note
-        anki_request("addNote",
-            note={
-                "deckName": DECK_NAME,
-                "modelName": MODEL_NAME,
-                "fields": fields,
-                "options": {
-                    "allowDuplicate": False
-                },
-                "tags": [f"level:{verb_data['level']}", "verb-pair", "edewakaru"]
-            }
-        )
-        print(f"  Added: {verb_id}")
-        return True  # New
+
+def load_json(path: Path):
+    """Parse a JSON file by memory-mapping it into orjson.
+
+    orjson parses the mapped bytes directly, so multi-MB combined files
+    skip the intermediate read buffer entirely. Empty files can't be
+    mapped, so fall back to a plain read for them.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return orjson.loads(memoryview(mm))
+
+
+def fields_hash(fields: dict) -> str:
+    """Stable hash of a note's fields for change detection."""
+    payload = orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def open_sync_state() -> sqlite3.Connection:
+    """Open (creating if needed) the local index of already-synced notes."""
+    conn = sqlite3.connect(SYNC_STATE_DB)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS synced ("
+        "verb_id TEXT PRIMARY KEY, note_id INTEGER, fields_hash TEXT)"
+    )
+    return conn
+
+
+def sync_verb_pairs(verb_pairs: list[dict]) -> tuple[int, int, int]:
+    """Sync a batch of verb pairs via batched `multi` requests.
+
+    A local SQLite index remembers the note id and fields hash from the
+    last run, so unchanged pairs skip AnkiConnect entirely and known
+    pairs skip the findNotes lookup. New pairs are looked up in one
+    `multi` with all the findNotes queries, then all writes go out in a
+    second `multi`. Returns (added, updated, skipped) counts.
+    """
+    added = 0
+    updated = 0
+    skipped = 0
+
+    state = open_sync_state()
+    try:
+        for start in range(0, len(verb_pairs), BATCH_SIZE):
+            chunk = verb_pairs[start:start + BATCH_SIZE]
+
+            # Phase 0: check the local index; unchanged pairs need no
+            # requests at all, known pairs already carry their note id
+            pending = []  # (verb_data, fields, hash, note_id or None)
+            unknown = []  # entries that still need a findNotes lookup
+            for verb_data in chunk:
+                fields = build_fields(verb_data)
+                current_hash = fields_hash(fields)
+                row = state.execute(
+                    "SELECT note_id, fields_hash FROM synced WHERE verb_id = ?",
+                    (verb_data["id"],)
+                ).fetchone()
+
+                if row and row[1] == current_hash:
+                    skipped += 1
+                    continue
+
+                entry = [verb_data, fields, current_hash, row[0] if row else None]
+                pending.append(entry)
+                if entry[3] is None:
+                    unknown.append(entry)
+
+            # Phase 1: look up notes the index doesn't know in one request
+            found = []
+            if unknown:
+                find_actions = [
+                    {
+                        "action": "findNotes",
+                        "params": {"query": f'"deck:{DECK_NAME}" "VerbPairID:{entry[0]["id"]}"'}
+                    }
+                    for entry in unknown
+                ]
+                find_results = anki_multi(find_actions)
+                for entry, (existing, error) in zip(unknown, find_results):
+                    if error:
+                        raise Exception(f"AnkiConnect error: {error}")
+                    if existing:
+                        entry[3] = existing[0]
+                        found.append(entry)
+
+            # Phase 1b: for notes that exist but aren't in the index,
+            # fetch the current fields in one notesInfo call and skip the
+            # update when nothing actually changed
+            if found:
+                infos = anki_request("notesInfo", notes=[entry[3] for entry in found])
+                unchanged = set()
+                for entry, info in zip(found, infos):
+                    remote_fields = {
+                        name: field["value"]
+                        for name, field in info.get("fields", {}).items()
+                    }
+                    if fields_hash(remote_fields) == entry[2]:
+                        unchanged.add(id(entry))
+                if unchanged:
+                    still_pending = []
+                    for entry in pending:
+                        if id(entry) in unchanged:
+                            state.execute(
+                                "INSERT OR REPLACE INTO synced (verb_id, note_id, fields_hash) "
+                                "VALUES (?, ?, ?)",
+                                (entry[0]["id"], entry[3], entry[2])
+                            )
+                            skipped += 1
+                        else:
+                            still_pending.append(entry)
+                    pending = still_pending
+                    state.commit()
+
+            # Phase 2: build an update or add action per verb pair
+            write_actions = []
+            for verb_data, fields, current_hash, note_id in pending:
+                if note_id is not None:
+                    write_actions.append({
+                        "action": "updateNoteFields",
+                        "params": {
+                            "note": {
+                                "id": note_id,
+                                "fields": fields
+                            }
+                        }
+                    })
+                else:
+                    write_actions.append({
+                        "action": "addNote",
+                        "params": {
+                            "note": {
+                                "deckName": DECK_NAME,
+                                "modelName": MODEL_NAME,
+                                "fields": fields,
+                                "options": {
+                                    "allowDuplicate": False
+                                },
+                                "tags": [f"level:{verb_data['level']}", "verb-pair", "edewakaru"]
+                            }
+                        }
+                    })
+
+            # Phase 3: apply all writes in one request, then count and
+            # index only the sub-actions AnkiConnect confirmed - a row
+            # recorded for a failed write would make every later run
+            # skip that pair as unchanged without ever retrying it
+            if write_actions:
+                write_results = anki_multi(write_actions)
+                failed = 0
+                for entry, action, (result, error) in zip(pending, write_actions, write_results):
+                    verb_data, fields, current_hash, note_id = entry
+                    if error is None and action["action"] == "addNote":
+                        if result is None:
+                            error = "addNote returned no note id"
+                        else:
+                            note_id = result
+
+                    if error:
+                        logger.error("  Failed %s for %s: %s",
+                                     action["action"], verb_data["id"], error)
+                        failed += 1
+                        continue
+
+                    if action["action"] == "addNote":
+                        logger.debug("  Added: %s", verb_data["id"])
+                        added += 1
+                    else:
+                        logger.debug("  Updated: %s", verb_data["id"])
+                        updated += 1
+                    state.execute(
+                        "INSERT OR REPLACE INTO synced (verb_id, note_id, fields_hash) "
+                        "VALUES (?, ?, ?)",
+                        (verb_data["id"], note_id, current_hash)
+                    )
+                state.commit()
+                if failed:
+                    raise Exception(f"{failed} AnkiConnect write action(s) failed")
+    finally:
+        state.close()
+
+    return added, updated, skipped
 
 
 def sync_all_verb_pairs():
@@ -390,29 +634,27 @@ def sync_all_verb_pairs():
     ensure_deck_exists()
     ensure_model_exists()
 
-    # Find all JSON files (excluding combined files)
-    json_files = [f for f in DATA_DIR.glob("*.json")
-                  if not f.name.endswith("_verb_pairs.json")]
-
-    print(f"\nSyncing {len(json_files)} verb pairs to Anki...")
+    # Find all JSON files (excluding combined files) with one scandir
+    # pass instead of glob building a Path per discarded entry
+    with os.scandir(DATA_DIR) as entries:
+        json_files = [
+            Path(entry.path) for entry in entries
+            if entry.name.endswith(".json")
+            and not entry.name.endswith("_verb_pairs.json")
+            and entry.is_file(follow_symlinks=False)
+        ]
 
-    added = 0
-    updated = 0
+    logger.info("\nSyncing %d verb pairs to Anki...", len(json_files))
 
-    for json_file in sorted(json_files):
-        with open(json_file, encoding="utf-8") as f:
-            data = json.load(f)
+    verb_pairs = [load_json(json_file) for json_file in sorted(json_files)]
 
-        is_new = add_or_update_note(data)
-        if is_new:
-            added += 1
-        else:
-            updated += 1
+    added, updated, skipped = sync_verb_pairs(verb_pairs)
 
-    print(f"\nSync complete!")
-    print(f"  Added: {added}")
-    print(f"  Updated: {updated}")
-    print(f"  Total: {added + updated}")
+    logger.info("\nSync complete!")
+    logger.info("  Added: %d", added)
+    logger.info("  Updated: %d", updated)
+    logger.info("  Unchanged: %d", skipped)
+    logger.info("  Total: %d", added + updated + skipped)
 
 
 def sync_level(level: str):
@@ -425,31 +667,27 @@ def sync_level(level: str):
 
     level_file = DATA_DIR / f"{level}_verb_pairs.json"
     if not level_file.exists():
-        print(f"Level file not found: {level_file}")
+        logger.error("Level file not found: %s", level_file)
         return
 
-    with open(level_file, encoding="utf-8") as f:
-        data = json.load(f)
-
-    print(f"\nSyncing {len(data)} {level} verb pairs to Anki...")
+    data = load_json(level_file)
 
-    added = 0
-    updated = 0
+    logger.info("\nSyncing %d %s verb pairs to Anki...", len(data), level)
 
-    for verb_data in data:
-        is_new = add_or_update_note(verb_data)
-        if is_new:
-            added += 1
-        else:
-            updated += 1
+    added, updated, skipped = sync_verb_pairs(data)
 
-    print(f"\nSync complete!")
-    print(f"  Added: {added}")
-    print(f"  Updated: {updated}")
+    logger.info("\nSync complete!")
+    logger.info("  Added: %d", added)
+    logger.info("  Updated: %d", updated)
+    logger.info("  Unchanged: %d", skipped)
 
 
 if __name__ == "__main__":
-    import sys
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        stream=sys.stdout
+    )
 
     if len(sys.argv) > 1:
         level = sys.argv[1]
@@ -4,16 +4,22 @@ Scraper for edewakaru.com transitive/intransitive verb pairs.
 Extracts verb pairs, example sentences, and images.
 """
 
-import json
+import functools
 import os
 import re
+import shutil
+import threading
 import time
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, Comment
 
 # Configuration
 BASE_URL = "https://www.edewakaru.com"
@@ -28,6 +34,7 @@ IMAGES_DIR = OUTPUT_DIR / "images"
 
 # Rate limiting
 REQUEST_DELAY = 1.0  # seconds between requests
+MAX_WORKERS = 4  # concurrent article fetches
 
 # Headers to mimic browser
 HEADERS = {
@@ -36,6 +43,18 @@ HEADERS = {
     "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
 }
 
+# Shared session so requests reuse pooled TCP/TLS connections. The
+# on-disk cache honors ETag/Last-Modified, so re-scraping an unchanged
+# site serves pages from SQLite instead of the network.
+_session = requests_cache.CachedSession(
+    str(OUTPUT_DIR / "edewakaru_cache"),
+    expire_after=7 * 24 * 3600,
+    cache_control=True,
+)
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 
 def ensure_dirs():
     """Create output directories if they don't exist."""
@@ -43,13 +62,32 @@ def ensure_dirs():
     IMAGES_DIR.mkdir(exist_ok=True)
 
 
+# Shared rate limiter: concurrent workers still hit the site at most
+# once per REQUEST_DELAY in aggregate
+_rate_lock = threading.Lock()
+_next_request_time = 0.0
+
+
+def rate_limit(delay: float = REQUEST_DELAY):
+    """Block until this thread's turn to issue a request."""
+    global _next_request_time
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_request_time - now
+        _next_request_time = max(now, _next_request_time) + delay
+    if wait > 0:
+        time.sleep(wait)
+
+
 def fetch_page(url: str) -> BeautifulSoup | None:
     """Fetch a page and return BeautifulSoup object."""
     try:
-        time.sleep(REQUEST_DELAY)
-        response = requests.get(url, headers=HEADERS, timeout=30)
+        # Cache hits don't touch the site, so don't burn a rate slot
+        if not _session.cache.contains(url=url):
+            rate_limit()
+        response = _session.get(url, headers=HEADERS, timeout=30)
         response.raise_for_status()
-        return BeautifulSoup(response.content, "html.parser")
+        return BeautifulSoup(response.content, "lxml")
     except requests.RequestException as e:
         print(f"Error fetching {url}: {e}")
         return None
@@ -79,8 +117,18 @@ def get_article_urls_from_category(category_url: str) -> list[str]:
         next_link = soup.select_one('a[rel="next"], .pager-next a, a:contains("次のページ")')
         if next_link:
             current_url = urljoin(BASE_URL, next_link.get("href", ""))
+            continue
+
+        # Fast path: grab the link right after the current page marker
+        # in one CSS traversal instead of int-parsing every pager entry
+        next_link = soup.select_one(
+            ".pager .current + a, .pager a.current + a, "
+            ".pagination .current + a, a.pager-next"
+        )
+        if next_link and next_link.get("href"):
+            current_url = urljoin(BASE_URL, next_link["href"])
         else:
-            # Try finding numbered pagination
+            # Fall back to numbered pagination
             pager = soup.select(".pager a, .pagination a")
             current_page = None
             for p in pager:
@@ -113,7 +161,7 @@ def download_image(img_url: str, verb_pair_id: str) -> str | None:
     """Download an image and return the local filename."""
     try:
         # Create a unique filename based on URL hash
-        url_hash = hashlib.md5(img_url.encode()).hexdigest()[:8]
+        url_hash = hashlib.blake2b(img_url.encode(), digest_size=4).hexdigest()
         ext = Path(urlparse(img_url).path).suffix or ".jpg"
         filename = f"{verb_pair_id}_{url_hash}{ext}"
         filepath = IMAGES_DIR / filename
@@ -121,12 +169,19 @@ def download_image(img_url: str, verb_pair_id: str) -> str | None:
         if filepath.exists():
             return filename
 
-        time.sleep(REQUEST_DELAY / 2)  # Shorter delay for images
-        response = requests.get(img_url, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-
-        with open(filepath, "wb") as f:
-            f.write(response.content)
+        rate_limit(REQUEST_DELAY / 2)  # Shorter delay for images
+        # Stream to disk so large images never sit fully in memory.
+        # Keep images out of the HTTP cache: the filepath.exists() check
+        # above already prevents refetches, and caching would buffer and
+        # store a second copy of every image body in the sqlite cache.
+        # Cache-Control: no-store is the only knob that skips the cache
+        # write path; the per-request DO_NOT_CACHE sentinel only skips
+        # reads and still persists the body
+        with _session.get(img_url, headers={**HEADERS, "Cache-Control": "no-store"},
+                          timeout=30, stream=True) as response:
+            response.raise_for_status()
+            with open(filepath, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=64 * 1024)
 
         return filename
     except Exception as e:
@@ -149,19 +204,60 @@ def parse_verb_pair_title(title: str) -> tuple[str, str] | None:
     return None
 
 
+# Subtrees whose text is never article content
+_SKIPPED_TAGS = {"script", "style", "noscript"}
+
+
+def content_text(content) -> str:
+    """Flatten an element's text nodes, skipping script/style subtrees.
+
+    Joins with the empty string, exactly like get_text(): inline markup
+    (<b>, styled <span>) must not split a sentence across lines, since
+    the example and question extractors are all line-oriented. Real line
+    breaks come from the whitespace-only nodes between block elements,
+    which are kept. Comments are excluded, as get_text() excludes them.
+    """
+    parts = [
+        s for s in content.find_all(string=True)
+        if not isinstance(s, Comment) and s.parent.name not in _SKIPPED_TAGS
+    ]
+    return "".join(parts)
+
+
+# Precompiled patterns for practice questions/answers - these are reused
+# for every article, so compile them once at import
+_CIRCLED_NUMBERS = "①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬⑭⑮"
+_CIRCLED_PATTERNS = [re.compile(rf"{c}[^\n①-⑩]+") for c in _CIRCLED_NUMBERS]
+_ANSWER_PATTERNS = [re.compile(rf"{c}([^①-⑩\n]+)") for c in _CIRCLED_NUMBERS]
+_ANSWER_SECTION = re.compile(r"【答え】(.+?)(?=【|$)", re.DOTALL)
+
+
+@functools.lru_cache(maxsize=256)
+def _example_pattern(verb: str, particle: str) -> re.Pattern:
+    """Compile a pattern matching lines containing both verb and particle."""
+    escaped = re.escape(verb)
+    return re.compile(
+        rf"[^\n]*(?:{escaped}[^\n]*{particle}|{particle}[^\n]*{escaped})[^\n]*"
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _reading_patterns(verb: str) -> tuple[re.Pattern, ...]:
+    """Compile the reading patterns for a verb once per process."""
+    # Pattern: verb（reading）or verb(reading) or verb【reading】
+    return (
+        re.compile(rf"{re.escape(verb)}[（(]([ぁ-んァ-ン]+)[）)]"),
+        re.compile(rf"{re.escape(verb)}【([ぁ-んァ-ン]+)】"),
+    )
+
+
 def extract_readings(soup: BeautifulSoup, verb: str) -> str | None:
     """Try to extract furigana/reading for a verb from the page."""
     # Look for ruby annotations or parenthetical readings
     text = soup.get_text()
 
-    # Pattern: verb（reading）or verb(reading)
-    patterns = [
-        rf"{re.escape(verb)}[（(]([ぁ-んァ-ン]+)[）)]",
-        rf"{re.escape(verb)}【([ぁ-んァ-ン]+)】",
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, text)
+    for pattern in _reading_patterns(verb):
+        match = pattern.search(text)
         if match:
             return match.group(1)
 
@@ -201,7 +297,7 @@ def parse_article(url: str, level: str) -> dict | None:
     if not content:
         content = soup
 
-    text = content.get_text()
+    text = content_text(content)
 
     # Extract example sentences
     examples = []
@@ -210,34 +306,24 @@ def parse_article(url: str, level: str) -> dict | None:
     # Pattern: Nounが + intransitive verb (自動詞)
     # Pattern: Nounを + transitive verb (他動詞)
 
+    # Find lines with the verbs and particles in a single regex pass
+    # instead of splitting into lines and scanning each one
     intransitive_examples = []
-    transitive_examples = []
-
-    # Find lines with the verbs and particles
-    lines = text.split("\n")
-    for line in lines:
+    for line in _example_pattern(intransitive, "が").findall(text):
         line = line.strip()
-        if not line:
-            continue
-
-        # Look for examples with が (intransitive)
-        if "が" in line and intransitive in line and "自動詞" in line:
-            intransitive_examples.append(line)
-        elif "が" in line and intransitive in line and len(line) < 100:
+        if "自動詞" in line or len(line) < 100:
             intransitive_examples.append(line)
 
-        # Look for examples with を (transitive)
-        if "を" in line and transitive in line and "他動詞" in line:
-            transitive_examples.append(line)
-        elif "を" in line and transitive in line and len(line) < 100:
+    transitive_examples = []
+    for line in _example_pattern(transitive, "を").findall(text):
+        line = line.strip()
+        if "他動詞" in line or len(line) < 100:
             transitive_examples.append(line)
 
     # Extract practice questions (①②③ etc.)
     practice_questions = []
-    circled_numbers = "①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬⑭⑮"
-    for char in circled_numbers:
-        pattern = rf"{char}[^\n①②③④⑤⑥⑦⑧⑨⑩]+"
-        matches = re.findall(pattern, text)
+    for pattern in _CIRCLED_PATTERNS:
+        matches = pattern.findall(text)
         for m in matches:
             if "【" in m and "】" not in m:
                 m = m + "】"  # Fix incomplete brackets
@@ -246,27 +332,35 @@ def parse_article(url: str, level: str) -> dict | None:
 
     # Extract answers if present
     answers = []
-    answer_section = re.search(r"【答え】(.+?)(?=【|$)", text, re.DOTALL)
+    answer_section = _ANSWER_SECTION.search(text)
     if answer_section:
         answer_text = answer_section.group(1)
-        for char in circled_numbers:
-            pattern = rf"{char}([^①②③④⑤⑥⑦⑧⑨⑩\n]+)"
-            match = re.search(pattern, answer_text)
+        for pattern in _ANSWER_PATTERNS:
+            match = pattern.search(answer_text)
             if match:
                 answers.append(match.group(1).strip())
 
-    # Download images
+    # Download images in parallel - they're independent and I/O-bound
     images = []
     img_tags = content.select("img")
+    candidates = []
     for img in img_tags[:5]:  # Limit to first 5 images
         src = img.get("src", "")
         if src and "resize.blogsys.jp" in src or "livedoor.blogimg.jp" in src:
-            filename = download_image(src, verb_id)
+            candidates.append((src, img.get("alt", "")))
+
+    if candidates:
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            filenames = executor.map(
+                lambda src: download_image(src, verb_id),
+                [src for src, _ in candidates]
+            )
+        for (src, alt), filename in zip(candidates, filenames):
             if filename:
                 images.append({
                     "filename": filename,
                     "original_url": src,
-                    "alt": img.get("alt", "")
+                    "alt": alt
                 })
 
     # Try to get readings
@@ -302,16 +396,29 @@ def scrape_level(level: str, category_url: str) -> list[dict]:
     article_urls = get_article_urls_from_category(category_url)
     print(f"Found {len(article_urls)} articles")
 
+    # Collect in submission order so the output files stay deterministic
+    # across runs (nothing is written until all futures finish anyway)
     results = []
-    for url in article_urls:
-        data = parse_article(url, level)
-        if data:
-            results.append(data)
-            # Save individual JSON
-            filepath = DATA_DIR / f"{data['id']}.json"
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"    Saved: {filepath.name}")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(parse_article, url, level) for url in article_urls]
+        for future in futures:
+            data = future.result()
+            if data:
+                results.append(data)
+
+    # Write all output in one pass at the end: compact per-id files for
+    # the sync script, then the level file atomically via a temp file
+    for data in results:
+        filepath = DATA_DIR / f"{data['id']}.json"
+        with open(filepath, "wb") as f:
+            f.write(orjson.dumps(data))
+
+    level_path = DATA_DIR / f"{level}_verb_pairs.json"
+    tmp_path = level_path.with_suffix(".json.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, level_path)
+    print(f"  Saved {len(results)} verb pairs to {level_path.name}")
 
     return results
 
@@ -328,8 +435,8 @@ def scrape_all():
 
     # Save combined JSON
     combined_path = DATA_DIR / "all_verb_pairs.json"
-    with open(combined_path, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
+    with open(combined_path, "wb") as f:
+        f.write(orjson.dumps(all_data, option=orjson.OPT_INDENT_2))
 
     print(f"\nScraping complete!")
     print(f"Total verb pairs: {sum(len(v) for v in all_data.values())}")
@@ -342,14 +449,9 @@ def scrape_beginner_only():
 
     data = scrape_level("beginner", CATEGORY_URLS["beginner"])
 
-    # Save level JSON
-    level_path = DATA_DIR / "beginner_verb_pairs.json"
-    with open(level_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
     print(f"\nBeginner scraping complete!")
     print(f"Total verb pairs: {len(data)}")
-    print(f"Data saved to: {level_path}")
+    print(f"Data saved to: {DATA_DIR / 'beginner_verb_pairs.json'}")
 
 
 if __name__ == "__main__":